@@ -1,8 +1,11 @@
+import html
+import os
 import re
 from pathlib import Path
 from typing import Dict, Tuple, Optional, List
 import urllib.parse
 
+import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
 
@@ -24,10 +27,30 @@ DEFAULT_MASTER_LIST = [
 DEFAULT_RELATION_MASTER = ["強化", "維持", "縮小", "終了"]
 
 
+# --- パース用の正規表現（毎回の re キャッシュ参照を避けるためモジュールレベルで事前コンパイル） ---
+_MD_TABLE_RE = re.compile(r"^\s*\|.*\n\s*\|[-: \t|]+\n", re.M)
+_MD_SEP_RE = re.compile(r"^\s*\|?\s*[-: ]+\s*(\|\s*[-: ]+\s*)+\|?$")
+_MERMAID_KEYWORDS = ("graph", "sequenceDiagram", "flowchart", "classDiagram", "stateDiagram")
+
+# Mermaid 埋め込み用の HTML テンプレート（呼び出しごとに組み立てない）
+_MERMAID_TEMPLATE = """
+<div class="mermaid">{src}</div>
+<script src="https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"></script>
+<script>mermaid.initialize({{startOnLoad:true}});</script>
+"""
+
+
 # ---- ユーティリティ -------------------------------------------------
 def list_md_files(data_dir: Path) -> List[Path]:
-    """指定ディレクトリ内の .md ファイルをソートして返す"""
-    return sorted([p for p in data_dir.glob("*.md") if p.is_file()])
+    """指定ディレクトリ内の .md ファイルをソートして返す
+
+    `os.scandir` は readdir の結果からファイル種別を返すので、
+    glob + `is_file()` のようなエントリごとの stat(2) が要らない。
+    """
+    with os.scandir(data_dir) as it:
+        entries = [e for e in it if e.name.endswith(".md") and e.is_file()]
+    entries.sort(key=lambda e: e.name)
+    return [Path(e.path) for e in entries]
 
 
 def load_text(path: Path) -> str:
@@ -36,39 +59,54 @@ def load_text(path: Path) -> str:
 
 
 def parse_content(text: str) -> Tuple[Optional[str], Dict[str, str]]:
-    """Markdown を解析し、パートナー名と '##' セクションを抽出して返す"""
-    partner_name: Optional[str] = None
-    m = re.search(r"(?m)^#\s*パートナー名\s*$", text)
-    if m:
-        rest = text[m.end():]
-        for line in rest.splitlines():
-            if line.strip():
-                partner_name = line.strip()
-                break
+    """Markdown を解析し、パートナー名と '##' セクションを抽出して返す
 
+    正規表現を使わず 1 パスの行走査で処理する（短い行指向 Markdown には
+    この方が速く、中間の Match オブジェクトも作らない）。
+    """
+    partner_name: Optional[str] = None
     sections: Dict[str, str] = {}
-    matches = list(re.finditer(r"(?m)^##\s*(.+)\s*$", text))
-    for idx, mm in enumerate(matches):
-        title = mm.group(1).strip()
-        start = mm.end()
-        end = matches[idx + 1].start() if idx + 1 < len(matches) else len(text)
-        sections[title] = text[start:end].strip()
+    current_title: Optional[str] = None
+    buf: List[str] = []
+    expecting_name = False
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if expecting_name and stripped:
+            partner_name = stripped
+            expecting_name = False
+        if line.startswith("##"):
+            title = line[2:].strip()
+            if title:
+                if current_title is not None:
+                    sections[current_title] = "\n".join(buf).strip()
+                current_title = title
+                buf = []
+                continue
+        elif line.startswith("#") and partner_name is None and line[1:].strip() == "パートナー名":
+            expecting_name = True
+            continue
+        if current_title is not None:
+            buf.append(line)
+
+    if current_title is not None:
+        sections[current_title] = "\n".join(buf).strip()
 
     return partner_name, sections
 
 
 def is_markdown_table(text: str) -> bool:
     """簡易判定: テキスト内にマークダウン表のヘッダ+区切り行があるかを返す"""
-    return bool(re.search(r"(?m)^\s*\|.*\n\s*\|[-: \t|]+\n", text))
+    return bool(_MD_TABLE_RE.search(text))
 
 
 def md_table_to_records(text: str):
     """マークダウン表を辞書レコードのリストに変換する。変換できない場合は None を返す"""
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    lines = [s for s in (ln.strip() for ln in text.splitlines()) if s]
     # ヘッダ行と区切り行を探す
     header_idx = None
     for i in range(len(lines) - 1):
-        if '|' in lines[i] and re.match(r"^\s*\|?\s*[-: ]+\s*(\|\s*[-: ]+\s*)+\|?$", lines[i + 1]):
+        if '|' in lines[i] and _MD_SEP_RE.match(lines[i + 1]):
             header_idx = i
             break
     if header_idx is None:
@@ -76,44 +114,74 @@ def md_table_to_records(text: str):
 
     def split_row(r: str):
         r = r.strip()
-        if r.startswith('|'):
+        if r and r[0] == '|':
             r = r[1:]
-        if r.endswith('|'):
+        if r and r[-1] == '|':
             r = r[:-1]
         return [c.strip() for c in r.split('|')]
 
     headers = split_row(lines[header_idx])
+    nh = len(headers)
     data_lines = lines[header_idx + 2 :]
     records = []
     for dl in data_lines:
         if '|' not in dl:
             continue
         cols = split_row(dl)
-        if len(cols) < len(headers):
-            cols += [''] * (len(headers) - len(cols))
+        lc = len(cols)
+        if lc < nh:
+            cols.extend([''] * (nh - lc))
+        elif lc > nh:
+            del cols[nh:]
         records.append(dict(zip(headers, cols)))
     return records
 
 
+@st.cache_data(show_spinner=False)
+def _parse_file_cached(path_str: str, mtime: float) -> Tuple[Optional[str], Dict[str, str]]:
+    """ファイルを読み込んでパースした結果をキャッシュする。
+
+    `mtime` はキャッシュキーの一部で、ファイル更新時に再パースさせるために渡す。
+    """
+    return parse_content(Path(path_str).read_text(encoding="utf-8"))
+
+
+@st.cache_data(show_spinner=False)
+def _extract_items_cached(text: str) -> List[str]:
+    """`extract_items` の結果をテキストをキーにキャッシュする。"""
+    return extract_items(text)
+
+
 # ----------------- ヘルパー関数 (トップレベル、初心者向けに分離) -----------------
-def load_master_list(data_dir: Path) -> List[str]:
+def _mtime_or_zero(path: Path) -> float:
+    """ファイルの更新時刻を返す（存在しなければ 0.0）。キャッシュキー用。"""
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+@st.cache_data(show_spinner=False)
+def load_master_list(data_dir_str: str, mtime: float) -> List[str]:
     """data フォルダ内の `domain-master.txt` を読み込み、存在しなければデフォルトを返す。
 
     引数:
-      data_dir: `Path` オブジェクト (通常は `Path(__file__).parent / "data"`)
+      data_dir_str: data フォルダのパス文字列
+      mtime: `domain-master.txt` の更新時刻（キャッシュキー、なければ 0.0）
     戻り値:
       マスター名のリスト
     """
-    master_path = data_dir / "domain-master.txt"
+    master_path = Path(data_dir_str) / "domain-master.txt"
     if master_path.exists():
         lines = [ln.strip() for ln in master_path.read_text(encoding="utf-8").splitlines()]
         return [ln for ln in lines if ln]
     return DEFAULT_MASTER_LIST
 
 
-def load_relation_master(data_dir: Path) -> List[str]:
+@st.cache_data(show_spinner=False)
+def load_relation_master(data_dir_str: str, mtime: float) -> List[str]:
     """`relation-master.txt` を読み込み、存在しなければデフォルトの関係性リストを返す。"""
-    p = data_dir / "relation-master.txt"
+    p = Path(data_dir_str) / "relation-master.txt"
     if p.exists():
         lines = [ln.strip() for ln in p.read_text(encoding="utf-8").splitlines()]
         return [ln for ln in lines if ln]
@@ -127,16 +195,18 @@ def extract_items(text: str) -> List[str]:
     """
     if not text:
         return []
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
     items: List[str] = []
-    for ln in lines:
-        if ln.startswith("*") or ln.startswith("-"):
-            items.append(ln.lstrip("*- ").strip())
+    for ln in text.splitlines():
+        s = ln.strip()
+        if not s:
+            continue
+        c0 = s[0]
+        if c0 == "*" or c0 == "-":
+            items.append(s.lstrip("*- ").strip())
+        elif "," in s:
+            items.extend(p for p in (t.strip() for t in s.split(",")) if p)
         else:
-            if "," in ln:
-                items.extend([p.strip() for p in ln.split(",") if p.strip()])
-            else:
-                items.append(ln)
+            items.append(s)
     return items
 
 
@@ -146,88 +216,107 @@ def is_mermaid(txt: str) -> bool:
         return False
     if "```mermaid" in txt:
         return True
-    first = txt.strip().splitlines()[0] if txt.strip().splitlines() else ""
-    keywords = ("graph", "sequenceDiagram", "flowchart", "classDiagram", "stateDiagram")
-    return any(first.startswith(k) for k in keywords)
+    s = txt.lstrip()
+    if not s:
+        return False
+    nl = s.find("\n")
+    first = s if nl < 0 else s[:nl]
+    return first.startswith(_MERMAID_KEYWORDS)
 
 
 def extract_mermaid_source(txt: str) -> str:
     """```mermaid``` ブロックがあれば中身を返す。なければ元テキストを返す。"""
-    if "```mermaid" in txt:
-        parts = txt.split("```mermaid")
-        if len(parts) > 1:
-            body = parts[1]
-            if "```" in body:
-                body = body.split("```")[0]
-            return body.strip()
-    return txt.strip()
+    _, sep, rest = txt.partition("```mermaid")
+    if not sep:
+        return txt.strip()
+    body, _, _ = rest.partition("```")
+    return body.strip()
 
 
 def render_mermaid_html(mermaid_src: str, height: int = 400) -> None:
-    """Mermaid CDN を使って HTML 埋め込みでレンダリングする（`components.html`）。"""
-    safe_src = mermaid_src
-    html = f"""
-<div class="mermaid">{safe_src}</div>
-<script src="https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"></script>
-<script>mermaid.initialize({{startOnLoad:true}});</script>
-"""
-    components.html(html, height=height)
+    """Mermaid CDN を使って HTML 埋め込みでレンダリングする（`components.html`）。
+
+    ソースは `html.escape` してから埋め込む（HTML としては誤挿入を防ぎつつ、
+    ブラウザが div のテキストとして元に戻すので Mermaid にはそのまま届く）。
+    """
+    components.html(_MERMAID_TEMPLATE.format(src=html.escape(mermaid_src)), height=height)
+
+
+@st.cache_data(show_spinner=False)
+def _classify_section(text: str) -> Tuple[str, object]:
+    """セクションテキストの描画種別を判定して (種別, ペイロード) を返す。
+
+    種別は "mermaid" / "empty" / "table" / "bullets" / "prose" のいずれか。
+    判定コストは同一テキストにつき一度だけ払い、再実行時はキャッシュを引く。
+    """
+    if is_mermaid(text):
+        return "mermaid", extract_mermaid_source(text)
+    if not text:
+        return "empty", None
+    if is_markdown_table(text):
+        records = md_table_to_records(text)
+        if records:
+            return "table", records
+    lines = [s for s in (ln.strip() for ln in text.splitlines()) if s]
+    # 箇条書き判定と項目抽出を 1 パスで行う（全行チェック + 再抽出の二度手間を避ける）
+    items: List[str] = []
+    all_bullets = bool(lines)
+    for s in lines:
+        if s[0] not in "*-":
+            all_bullets = False
+            break
+        items.append(s.lstrip("*- ").strip())
+    if all_bullets:
+        return "bullets", items
+    first = lines[0] if lines else text
+    rest = "\n".join(lines[1:])
+    return "prose", (first, rest)
+
+
+@st.cache_data(show_spinner=False)
+def _records_to_df(text: str):
+    """マークダウン表テキストを DataFrame に変換してキャッシュする。変換できなければ None。"""
+    records = md_table_to_records(text)
+    return pd.DataFrame(records) if records else None
 
 
 def render_value(value: str, compact: bool = False) -> None:
     """値の描画: テーブル/リスト/文書/Mermaid を自動判定して適切に出力する。
 
     compact=True にすると見出しを大きくせず簡素に出力する（`製品サービス` 用）。
+    判定自体は `_classify_section` がキャッシュするので、再実行時は描画だけを行う。
     """
-    # Mermaid の優先判定
-    if is_mermaid(value):
-        src = extract_mermaid_source(value)
+    kind, payload = _classify_section(value)
+    # compact の分岐は出力関数をローカルに束ねて一度だけ行う
+    out = st.write if compact else st.subheader
+
+    if kind == "mermaid":
         try:
-            render_mermaid_html(src, height=400)
-            return
+            render_mermaid_html(payload, height=400)
         except Exception:
-            st.code(src)
-            return
+            st.code(payload)
+        return
 
-    if not value:
-        if compact:
-            st.write("-")
-        else:
-            st.subheader("-")
+    if kind == "empty":
+        out("-")
         return
 
-    if is_markdown_table(value):
-        records = md_table_to_records(value)
-        if records:
-            try:
-                import pandas as pd
-
-                df = pd.DataFrame(records)
-                st.dataframe(df)
-                return
-            except Exception:
-                st.table(records)
-                return
-
-    lines = [ln for ln in value.splitlines() if ln.strip()]
-    if lines and all(ln.strip().startswith("*") or ln.strip().startswith("-") for ln in lines):
-        items = [ln.lstrip("*- ").strip() for ln in lines]
-        if compact:
-            st.write("、".join(items))
+    if kind == "table":
+        df = _records_to_df(value)
+        if df is not None:
+            st.dataframe(df)
         else:
-            st.subheader("、".join(items))
+            st.table(payload)
         return
 
-    first = lines[0] if lines else value
-    rest = "\n".join(lines[1:])
-    if compact:
-        st.write(first)
-        if rest:
-            st.write(rest)
-    else:
-        st.subheader(first)
-        if rest:
-            st.write(rest)
+    if kind == "bullets":
+        out("、".join(payload))
+        return
+
+    first, rest = payload
+    out(first)
+    if rest:
+        st.write(rest)
 
 
 def render_label_and_value(label: str, value: str) -> None:
@@ -252,7 +341,8 @@ def render_master_grid(master_list: List[str], highlighted: set, cols_per_row: i
                     st.info(it)
                 else:
                     st.code(it)
-    extras = [it for it in highlighted if it not in master_list]
+    master_set = master_list if isinstance(master_list, (set, frozenset)) else frozenset(master_list)
+    extras = [it for it in highlighted if it not in master_set]
     if extras:
         st.write("その他: " + "、".join(extras))
 
@@ -273,33 +363,55 @@ def render_kv_row(label: str, value: str, master_list: List[str], renkei_items:
     render_value(value, compact=compact)
 
 
-def show_mapping_page(data_dir: Path, files: List[Path], master_list: List[str]) -> None:
-    """ドメイン（master_list）の枠を作り、各枠内に "パートナー名(リレーションレベル)" を配置する表示ページ。
+@st.cache_data(show_spinner=False)
+def _build_mapping_index(
+    path_strs: Tuple[str, ...],
+    mtimes: Tuple[float, ...],
+    master_list: Tuple[str, ...],
+) -> Tuple[Dict[str, List[Tuple[str, str]]], List[Tuple[str, str]]]:
+    """マッピングページ用のインデックスを構築する（純粋なデータ作成、描画はしない）。
 
-    シンプル実装: 3列グリッドで master を並べ、各ボックス内は `st.info` を使って枠表示します。
+    戻り値は (ドメイン名 -> [(ラベル, URLエンコード済みファイル名)], その他のリスト)。
+    URLエンコードは複数ドメインに出現するファイルでも一度だけ行う。
     """
-    st.title("ドメイン別マッピング")
-    # すべてのファイルを走査して、パートナーとそのリレーション情報を収集
     mapping: Dict[str, List[Tuple[str, str]]] = {m: [] for m in master_list}
-    others: List[str] = []
-    for p in files:
+    others: List[Tuple[str, str]] = []
+    master_set = frozenset(master_list)
+    _quote = urllib.parse.quote
+    for path_str, mtime in zip(path_strs, mtimes):
         try:
-            txt = load_text(p)
+            pname, secs = _parse_file_cached(path_str, mtime)
         except Exception:
             continue
-        pname, secs = parse_content(txt)
         name = pname or "(名前不明)"
-        rlevel = secs.get("リレーションレベル", "-")
-        renkei_txt = secs.get("連係領域", "")
-        items = extract_items(renkei_txt)
+        _get = secs.get
+        rlevel = _get("リレーションレベル", "-")
+        renkei_txt = _get("連係領域", "")
+        items = _extract_items_cached(renkei_txt)
         label = f"{name}({rlevel})"
+        quoted = _quote(Path(path_str).name, safe='')
         matched = False
         for it in items:
-            if it in master_list:
-                mapping[it].append((label, p.name))
+            if it in master_set:
+                mapping[it].append((label, quoted))
                 matched = True
         if not matched:
-            others.append((label, p.name))
+            others.append((label, quoted))
+    return mapping, others
+
+
+def show_mapping_page(data_dir: Path, files: List[Path], master_list: List[str]) -> None:
+    """ドメイン（master_list）の枠を作り、各枠内に "パートナー名(リレーションレベル)" を配置する表示ページ。
+
+    シンプル実装: 3列グリッドで master を並べ、各ボックス内は `st.info` を使って枠表示します。
+    インデックス構築はキャッシュされるので、再実行時は描画だけを行います。
+    """
+    st.title("ドメイン別マッピング")
+    mapping, others = _build_mapping_index(
+        tuple(str(p) for p in files),
+        tuple(_mtime_or_zero(p) for p in files),
+        tuple(master_list),
+    )
 
     # 表示: 3列グリッドで master_list を表示
     cols_per_row = 3
@@ -308,13 +420,9 @@ def show_mapping_page(data_dir: Path, files: List[Path], master_list: List[str])
         cols = st.columns(len(chunk))
         for c, m in zip(cols, chunk):
             with c:
-                content = mapping.get(m, [])
+                content = mapping[m]
                 if content:
-                    md_lines = []
-                    for label, fname in content:
-                        q = urllib.parse.quote(fname, safe='')
-                        md_lines.append(f"- [{label}](?mode=詳細&file={q})")
-                    md = "\n".join(md_lines)
+                    md = "\n".join(f"- [{label}](?mode=詳細&file={q})" for label, q in content)
                     st.info(f"**{m}**\n\n" + md)
                 else:
                     st.info(f"**{m}**\n\n(なし)")
@@ -323,8 +431,7 @@ def show_mapping_page(data_dir: Path, files: List[Path], master_list: List[str])
     if others:
         st.markdown("---")
         st.subheader("その他（マスターにない領域）")
-        for label, fname in others:
-            q = urllib.parse.quote(fname, safe='')
+        for label, q in others:
             st.write(f"- [{label}](?mode=詳細&file={q})")
 
 
@@ -340,62 +447,59 @@ def main() -> None:
         st.error(f"data ディレクトリが見つかりません: {data_dir}")
         return
     files = list_md_files(data_dir)
+    # ファイル名 -> Path の対応を一度だけ作る（分岐ごとの [p.name for p in files] を避ける）
+    name_to_path = {p.name: p for p in files}
     # クエリパラメータを読んで直接マッピング／詳細表示に遷移できるようにする
     qp = st.query_params
     qp_mode = qp.get("mode", [None])[0]
     qp_file = qp.get("file", [None])[0]
 
-    master_list_for_sidebar = load_master_list(data_dir)
+    # マスターリストはプロセス内で一度だけ読み込み、以降の分岐で使い回す
+    master_list = load_master_list(str(data_dir), _mtime_or_zero(data_dir / "domain-master.txt"))
+    relation_master = load_relation_master(str(data_dir), _mtime_or_zero(data_dir / "relation-master.txt"))
     # クエリでマッピング指定なら直接表示
     if qp_mode == "マッピング":
-        show_mapping_page(data_dir, files, master_list_for_sidebar)
+        show_mapping_page(data_dir, files, master_list)
         return
-    # クエリで詳細指定ならそのファイルを開いて表示
+    # 表示対象ファイルを決める（読み込み・パースは選択後に一度だけ行う）
+    # クエリで詳細指定ならそのファイルを選択
     if qp_mode == "詳細" and qp_file:
         # URL デコード
         fname = urllib.parse.unquote(qp_file)
-        if fname in [p.name for p in files]:
-            selected_path = data_dir / fname
-            try:
-                text = load_text(selected_path)
-            except Exception as e:
-                st.error(f"ファイル読み込みエラー: {e}")
-                return
-            partner_name, sections = parse_content(text)
-            # 続けて通常の詳細レンダリングに進むため、ファイルは選択済みとして処理する
-        else:
+        if fname not in name_to_path:
             st.error("指定されたファイルが見つかりません。")
             return
+        selected_path = name_to_path[fname]
     else:
         # サイドバー: 表示モード選択とファイル一覧
         mode = st.sidebar.radio("表示モード", ["詳細", "マッピング"], index=0, key="mode_radio")
         if mode == "マッピング":
-            show_mapping_page(data_dir, files, master_list_for_sidebar)
+            show_mapping_page(data_dir, files, master_list)
             return
         st.sidebar.title("ファイル一覧")
         if not files:
             st.sidebar.info("data フォルダに .md ファイルがありません")
             return
-        choice = st.sidebar.radio("表示するファイルを選択", [p.name for p in files], key="file_radio")
-        selected_path = data_dir / choice
-        try:
-            text = load_text(selected_path)
-        except Exception as e:
-            st.error(f"ファイル読み込みエラー: {e}")
-            return
-        partner_name, sections = parse_content(text)
-
-    # 必要なフィールドを取り出す
-    relation_level = sections.get("リレーションレベル", "")
-    renkei_iki = sections.get("連係領域", "")
-    renkei_mokuteki = sections.get("連係目的", "")
-    renkei_saki = sections.get("連携先", "")
-    url = sections.get("URL", "")
-    kankeisha = sections.get("関係者との接点", "")
-
-    # マスターリストと選択項目を用意（トップレベルのヘルパーを利用）
-    master_list = load_master_list(data_dir)
-    relation_master = load_relation_master(data_dir)
+        choice = st.sidebar.radio("表示するファイルを選択", list(name_to_path), key="file_radio")
+        selected_path = name_to_path[choice]
+
+    # どちらの経路でもここで一度だけ読み込み・パースする（キャッシュ済みなら即時）
+    try:
+        partner_name, sections = _parse_file_cached(str(selected_path), selected_path.stat().st_mtime)
+    except Exception as e:
+        st.error(f"ファイル読み込みエラー: {e}")
+        return
+
+    # 必要なフィールドを取り出す（メソッド束縛を一度だけ解決する）
+    _get = sections.get
+    relation_level = _get("リレーションレベル", "")
+    renkei_iki = _get("連係領域", "")
+    renkei_mokuteki = _get("連係目的", "")
+    renkei_saki = _get("連携先", "")
+    url = _get("URL", "")
+    kankeisha = _get("関係者との接点", "")
+
+    # 選択項目を用意（マスターリストは冒頭で読み込み済み）
     renkei_items = set(extract_items(renkei_iki))
     compact_labels = {"製品サービス", "連係目的"}
 